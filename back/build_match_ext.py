@@ -0,0 +1,24 @@
+"""Build the optional Cython matching kernels in place (snapshot/_match.*.so).
+
+    pip install cython setuptools
+    python build_match_ext.py
+
+This is a standalone helper, not the project's packaging: the app runs without
+it and falls back to Numba or NumPy.
+"""
+
+from Cython.Build import cythonize
+from setuptools import Distribution
+from setuptools.command.build_ext import build_ext
+
+
+def main() -> None:
+    dist = Distribution({"ext_modules": cythonize("snapshot/_match.pyx")})
+    cmd = build_ext(dist)
+    cmd.inplace = True
+    cmd.ensure_finalized()
+    cmd.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""Compiled dense-matching kernels; same interface as `_match_numba`.
+
+Build in place with `python build_match_ext.py`.
+"""
+
+import numpy as np
+
+from libc.stdint cimport int64_t
+
+
+def pair_dist2(
+    const double[::1] d_lat,
+    const double[::1] d_lng,
+    const double[::1] u_lat,
+    const double[::1] u_lng,
+    double cos_lat,
+):
+    """Flattened (D * U) squared distances, row-major by driver."""
+    cdef Py_ssize_t drivers_n = d_lat.shape[0]
+    cdef Py_ssize_t users_n = u_lat.shape[0]
+    cdef Py_ssize_t di, ui, row
+    cdef double dx, dy
+    out = np.empty(drivers_n * users_n, dtype=np.float64)
+    cdef double[::1] dist2 = out
+    with nogil:
+        for di in range(drivers_n):
+            row = di * users_n
+            for ui in range(users_n):
+                dx = (d_lng[di] - u_lng[ui]) * cos_lat
+                dy = d_lat[di] - u_lat[ui]
+                dist2[row + ui] = dx * dx + dy * dy
+    return out
+
+
+def greedy_accept(
+    const int64_t[::1] order,
+    Py_ssize_t users_n,
+    unsigned char[::1] used_drivers,
+    unsigned char[::1] used_users,
+    Py_ssize_t limit,
+):
+    """Walk flat pair indices in distance order, updating the used masks in place.
+
+    Returns up to `limit` new (driver, user) index pairs as an (n, 2) array.
+    """
+    out = np.empty((limit, 2), dtype=np.int64)
+    cdef int64_t[:, ::1] pairs = out
+    cdef Py_ssize_t i, di, ui
+    cdef Py_ssize_t found = 0
+    with nogil:
+        for i in range(order.shape[0]):
+            if found >= limit:
+                break
+            di = order[i] // users_n
+            ui = order[i] % users_n
+            if used_drivers[di] or used_users[ui]:
+                continue
+            used_drivers[di] = 1
+            used_users[ui] = 1
+            pairs[found, 0] = di
+            pairs[found, 1] = ui
+            found += 1
+    return out[:found]
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+from threading import Lock
+
+import numpy as np
+from numba import config, njit, prange
+
+
+# Below this many pairs thread start-up costs more than the fill itself.
+_PARALLEL_MIN_PAIRS = 250_000
+# Read once here: get_num_threads() from request threads hangs interpreter exit under TBB.
+_PARALLEL_THREADS = config.NUMBA_NUM_THREADS
+
+
+@njit(cache=True, fastmath=True)
+def _fill_dist2_serial(d_lat, d_lng, u_lat, u_lng, cos_lat):
+    drivers_n = d_lat.shape[0]
+    users_n = u_lat.shape[0]
+    dist2 = np.empty(drivers_n * users_n, dtype=np.float64)
+    for di in range(drivers_n):
+        row = di * users_n
+        for ui in range(users_n):
+            dx = (d_lng[di] - u_lng[ui]) * cos_lat
+            dy = d_lat[di] - u_lat[ui]
+            dist2[row + ui] = dx * dx + dy * dy
+    return dist2
+
+
+# A separate function rather than a second njit() of the serial one: the on-disk
+# cache is keyed by qualname, not by `parallel`, so both builds would share an entry.
+@njit(cache=True, fastmath=True, parallel=True)
+def _fill_dist2_parallel(d_lat, d_lng, u_lat, u_lng, cos_lat):
+    drivers_n = d_lat.shape[0]
+    users_n = u_lat.shape[0]
+    dist2 = np.empty(drivers_n * users_n, dtype=np.float64)
+    # Rows are independent, so the driver loop can be split across threads.
+    for di in prange(drivers_n):
+        row = di * users_n
+        for ui in range(users_n):
+            dx = (d_lng[di] - u_lng[ui]) * cos_lat
+            dy = d_lat[di] - u_lat[ui]
+            dist2[row + ui] = dx * dx + dy * dy
+    return dist2
+
+
+_parallel_lock = Lock()
+
+
+def pair_dist2(
+    d_lat: np.ndarray,
+    d_lng: np.ndarray,
+    u_lat: np.ndarray,
+    u_lng: np.ndarray,
+    cos_lat: float,
+) -> np.ndarray:
+    """Flattened (D * U) squared distances, row-major by driver."""
+    if d_lat.shape[0] * u_lat.shape[0] >= _PARALLEL_MIN_PAIRS and _PARALLEL_THREADS > 1:
+        # Numba's default workqueue layer can't take parallel launches from several
+        # threads at once (concurrent regenerations), so only one caller runs the
+        # parallel fill; anyone else falls back to the serial build instead of waiting.
+        if _parallel_lock.acquire(blocking=False):
+            try:
+                return _fill_dist2_parallel(d_lat, d_lng, u_lat, u_lng, cos_lat)
+            finally:
+                _parallel_lock.release()
+    return _fill_dist2_serial(d_lat, d_lng, u_lat, u_lng, cos_lat)
+
+
+@njit(cache=True)
+def greedy_accept(
+    order: np.ndarray,
+    users_n: int,
+    used_drivers: bytearray,
+    used_users: bytearray,
+    limit: int,
+) -> np.ndarray:
+    """Walk flat pair indices in distance order, updating the used masks in place.
+
+    Returns up to `limit` new (driver, user) index pairs as an (n, 2) array.
+    """
+    out = np.empty((limit, 2), dtype=np.int64)
+    found = 0
+    for flat in order:
+        if found >= limit:
+            break
+        di = flat // users_n
+        ui = flat % users_n
+        if used_drivers[di] or used_users[ui]:
+            continue
+        used_drivers[di] = 1
+        used_users[ui] = 1
+        out[found, 0] = di
+        out[found, 1] = ui
+        found += 1
+    return out[:found]
@@ -1,77 +1,214 @@
 from __future__ import annotations
 
+import hashlib
+import heapq
+import itertools
 import math
-import random
-import secrets
 import time
 from dataclasses import dataclass
-from threading import Lock
+from functools import cache
+from threading import Condition, Lock
 from typing import Any
 
+import numpy as np
+import orjson
 from django.conf import settings
+from scipy.spatial import cKDTree
+
+# Compiled dense-matching kernels, best first: the Cython extension (built with
+# `python build_match_ext.py`), then Numba, else the NumPy path below.
+try:
+    from . import _match as _dense_kernels
+except ImportError:
+    try:
+        from . import _match_numba as _dense_kernels
+    except ImportError:
+        _dense_kernels = None
+
+
+# Below this many driver/user pairs the dense matrix beats building a k-d tree.
+_DENSE_MAX_PAIRS = 40_000 if _dense_kernels is not None else 10_000
+# Above 1/N of the smaller side the k-d tree spends too long on conflicts.
+_KDTREE_MATCH_FRACTION = 4
+# The dense matcher sorts pairs in bands of match_count * N, growing N-fold each time.
+_PARTITION_FACTOR = 4
 
 
 @dataclass(frozen=True)
-class TrackedPoint:
-    id: str
-    lat: float
-    lng: float
+class PointBatch:
+    """Generated points as parallel columns (ids + float64 lat/lng arrays)."""
+
+    ids: list[str]
+    lat: np.ndarray
+    lng: np.ndarray
+
+    def __len__(self) -> int:
+        return len(self.ids)
 
+    def to_dicts(self) -> list[dict[str, Any]]:
+        return [
+            {"id": i, "lat": lat, "lng": lng}
+            for i, lat, lng in zip(self.ids, self.lat.tolist(), self.lng.tolist())
+        ]
 
-def _random_id(prefix: str) -> str:
-    return f"{prefix}_{secrets.token_urlsafe(8)}"
 
+# Snapshot sequence number; keeps ids unique across regenerations in this process.
+# `next()` on itertools.count is atomic, so no lock is needed.
+_snapshot_seq = itertools.count(1)
 
-def _rand_point(bounds: dict[str, float]) -> tuple[float, float]:
-    lat = random.uniform(bounds["min_lat"], bounds["max_lat"])
-    lng = random.uniform(bounds["min_lng"], bounds["max_lng"])
-    return lat, lng
 
+def _generate_points(
+    prefix: str,
+    n: int,
+    bounds: dict[str, float],
+    rng: np.random.Generator,
+    seq: int,
+) -> PointBatch:
+    lat = rng.uniform(bounds["min_lat"], bounds["max_lat"], size=n)
+    lng = rng.uniform(bounds["min_lng"], bounds["max_lng"], size=n)
+    # IDs are display labels only: sequence + index is unique without any randomness.
+    ids = [f"{prefix}_{seq}_{i:04d}" for i in range(n)]
+    return PointBatch(ids=ids, lat=lat, lng=lng)
+
+
+def _cos_lat(bounds: dict[str, float]) -> float:
+    # A city-scale box spans a fraction of a degree, so one cos(lat) fits every pair.
+    return math.cos(math.radians((bounds["min_lat"] + bounds["max_lat"]) * 0.5))
 
-def _approx_dist2(a: TrackedPoint, b: TrackedPoint) -> float:
-    # Fast-enough distance for "nearest" in a city-scale box.
-    mean_lat_rad = math.radians((a.lat + b.lat) / 2.0)
-    dx = (a.lng - b.lng) * math.cos(mean_lat_rad)
-    dy = a.lat - b.lat
+
+def _pair_dist2(drivers: PointBatch, users: PointBatch, cos_lat: float) -> np.ndarray:
+    # Fast-enough distance for "nearest" in a city-scale box, as a (D, U) matrix.
+    dx = (drivers.lng[:, None] - users.lng[None, :]) * cos_lat
+    dy = drivers.lat[:, None] - users.lat[None, :]
     return dx * dx + dy * dy
 
 
-def _generate_points(prefix: str, n: int, bounds: dict[str, float]) -> list[TrackedPoint]:
-    pts: list[TrackedPoint] = []
-    for _ in range(n):
-        lat, lng = _rand_point(bounds)
-        pts.append(TrackedPoint(id=_random_id(prefix), lat=lat, lng=lng))
-    return pts
+def _nearest_band(dist2: np.ndarray, lo: float, k: int) -> tuple[np.ndarray, float]:
+    # Flat indices of pairs with lo < dist2 <= (k-th smallest distance), sorted by
+    # distance, plus that upper bound. Bounding by value keeps ties in one band.
+    hi = float(np.partition(dist2, k - 1)[k - 1]) if k < dist2.size else math.inf
+    band = np.flatnonzero((dist2 > lo) & (dist2 <= hi))
+    return band[np.argsort(dist2[band])], hi
+
+
+def _greedy_accept(
+    order: np.ndarray,
+    users_n: int,
+    used_drivers: bytearray,
+    used_users: bytearray,
+    limit: int,
+) -> list[tuple[int, int]]:
+    out: list[tuple[int, int]] = []
+    for flat in order.tolist():
+        if len(out) >= limit:
+            break
+        di, ui = divmod(flat, users_n)
+        if used_drivers[di] or used_users[ui]:
+            continue
+        used_drivers[di] = 1
+        used_users[ui] = 1
+        out.append((di, ui))
+    return out
+
+
+def _greedy_pairs_dense(
+    drivers: PointBatch,
+    users: PointBatch,
+    match_count: int,
+    cos_lat: float,
+) -> list[tuple[int, int]]:
+    # Greedy "global nearest pairs":
+    # build all pair distances (<= 1e6), then pick first non-conflicting pairs in
+    # distance order. Pairs are sorted lazily in growing bands of nearest
+    # candidates, so we stop sorting as soon as enough matches are accepted.
+    drivers_n, users_n = len(drivers), len(users)
+    if _dense_kernels is not None:
+        dist2 = _dense_kernels.pair_dist2(drivers.lat, drivers.lng, users.lat, users.lng, cos_lat)
+    else:
+        dist2 = _pair_dist2(drivers, users, cos_lat).ravel()
+    # One-byte used masks; bytearray is writable from every kernel and cheaper
+    # than ndarray to index from Python.
+    used_drivers, used_users = bytearray(drivers_n), bytearray(users_n)
+
+    target = min(match_count, drivers_n, users_n)
+    k = target * _PARTITION_FACTOR
+    lo = -math.inf
+    pairs: list[tuple[int, int]] = []
+    while len(pairs) < target and lo < math.inf:
+        band, lo = _nearest_band(dist2, lo, k)
+        limit = target - len(pairs)
+        if _dense_kernels is not None:
+            new = _dense_kernels.greedy_accept(band, users_n, used_drivers, used_users, limit)
+            pairs.extend((di, ui) for di, ui in new.tolist())
+        else:
+            pairs.extend(_greedy_accept(band, users_n, used_drivers, used_users, limit))
+        k *= _PARTITION_FACTOR
+    return pairs
+
+
+def _greedy_pairs_kdtree(
+    drivers: PointBatch,
+    users: PointBatch,
+    match_count: int,
+    cos_lat: float,
+) -> list[tuple[int, int]]:
+    # Same greedy result as the dense path, without the (D, U) matrix:
+    # keep each driver's nearest still-free user in a heap and re-query on conflict.
+    # Longitudes are scaled by cos_lat so plain Euclidean matches the dense metric.
+    drivers_xy = np.column_stack((drivers.lng * cos_lat, drivers.lat))
+    users_xy = np.column_stack((users.lng * cos_lat, users.lat))
+    tree = cKDTree(users_xy)
+
+    dists, idxs = tree.query(drivers_xy, k=1)
+    heap = list(zip(dists.tolist(), range(len(drivers)), idxs.tolist()))
+    heapq.heapify(heap)
+    k_per_driver = [min(2, len(users))] * len(drivers)
+
+    users_n = len(users)
+    used_users = bytearray(users_n)
+    out: list[tuple[int, int]] = []
+    while heap and len(out) < match_count:
+        _, di, ui = heapq.heappop(heap)
+        if not used_users[ui]:
+            used_users[ui] = 1
+            out.append((di, ui))
+            continue
+
+        # Stale candidate: widen this driver's query until a free user shows up.
+        k = k_per_driver[di]
+        while True:
+            # k=1 (a single user) makes query() return scalars, not arrays.
+            cand_d, cand_u = map(np.atleast_1d, tree.query(drivers_xy[di], k=k))
+            free = next(
+                ((d, u) for d, u in zip(cand_d.tolist(), cand_u.tolist()) if not used_users[u]),
+                None,
+            )
+            if free is not None or k >= users_n:
+                break
+            k = min(users_n, k * 2)
+        if free is not None:
+            heapq.heappush(heap, (free[0], di, free[1]))
+        k_per_driver[di] = k
+    return out
 
 
 def _match_nearest(
-    drivers: list[TrackedPoint],
-    users: list[TrackedPoint],
+    drivers: PointBatch,
+    users: PointBatch,
     match_count: int,
+    cos_lat: float,
 ) -> list[dict[str, str]]:
-    if match_count <= 0 or not drivers or not users:
+    if match_count <= 0 or not len(drivers) or not len(users):
         return []
 
-    # Greedy "global nearest pairs":
-    # build all pair distances (<= 1e6), sort, then pick first non-conflicting pairs.
-    pairs: list[tuple[float, int, int]] = []
-    for di, d in enumerate(drivers):
-        for ui, u in enumerate(users):
-            pairs.append((_approx_dist2(d, u), di, ui))
-    pairs.sort(key=lambda x: x[0])
-
-    used_drivers: set[int] = set()
-    used_users: set[int] = set()
-    out: list[dict[str, str]] = []
-    for _, di, ui in pairs:
-        if di in used_drivers or ui in used_users:
-            continue
-        used_drivers.add(di)
-        used_users.add(ui)
-        out.append({"driver": drivers[di].id, "user": users[ui].id})
-        if len(out) >= match_count:
-            break
-    return out
+    if (
+        len(drivers) * len(users) <= _DENSE_MAX_PAIRS
+        or match_count * _KDTREE_MATCH_FRACTION >= min(len(drivers), len(users))
+    ):
+        pairs = _greedy_pairs_dense(drivers, users, match_count, cos_lat)
+    else:
+        pairs = _greedy_pairs_kdtree(drivers, users, match_count, cos_lat)
+    return [{"driver": drivers.ids[di], "user": users.ids[ui]} for di, ui in pairs]
 
 
 def generate_snapshot(
@@ -83,41 +220,56 @@ def generate_snapshot(
     match_ratio: float = 0.7,
     seed: int | None = None,
 ) -> dict[str, Any]:
-    if seed is not None:
-        random.seed(seed)
+    # A local generator: seeding never touches the process-wide `random` state.
+    rng = np.random.default_rng(seed)
 
-    drivers_n = drivers_count if drivers_count is not None else random.randint(0, max_count)
-    users_n = users_count if users_count is not None else random.randint(0, max_count)
+    drivers_n = drivers_count if drivers_count is not None else int(rng.integers(0, max_count, endpoint=True))
+    users_n = users_count if users_count is not None else int(rng.integers(0, max_count, endpoint=True))
 
     drivers_n = max(0, min(max_count, drivers_n))
     users_n = max(0, min(max_count, users_n))
 
-    drivers = _generate_points("driver", drivers_n, bounds)
-    users = _generate_points("user", users_n, bounds)
+    seq = next(_snapshot_seq)
+    drivers = _generate_points("driver", drivers_n, bounds, rng, seq)
+    users = _generate_points("user", users_n, bounds, rng, seq)
 
     limit = min(len(drivers), len(users))
     # Prefer higher matching density: ~70% of the smaller side by default (configurable).
     # Still keep a bit of randomness so it doesn't look "locked" each refresh.
-    if limit > 0:
-        ratio = max(0.0, min(1.0, float(match_ratio)))
+    # A ratio of 0 or 1 means "none" / "all", so no jitter is drawn for those.
+    ratio = max(0.0, min(1.0, float(match_ratio)))
+    if limit <= 0 or ratio <= 0.0:
+        match_count = 0
+    elif ratio >= 1.0 - 1e-9:
+        match_count = limit
+    else:
         base = int(round(limit * ratio))
         jitter = max(0, int(round(limit * 0.1)))  # ±10% jitter
         low = max(0, min(limit, base - jitter))
         high = max(0, min(limit, base + jitter))
-        match_count = random.randint(low, high)
-    else:
-        match_count = 0
-    matchs = _match_nearest(drivers, users, match_count)
+        match_count = int(rng.integers(low, high, endpoint=True))
+    matchs = _match_nearest(drivers, users, match_count, _cos_lat(bounds))
 
     return {
-        "drivers": [{"id": d.id, "lat": d.lat, "lng": d.lng} for d in drivers],
-        "users": [{"id": u.id, "lat": u.lat, "lng": u.lng} for u in users],
+        "drivers": drivers.to_dicts(),
+        "users": users.to_dicts(),
         "matchs": matchs,
     }
 
 
+@dataclass(frozen=True)
+class CachedSnapshot:
+    """A generated snapshot, kept only as its pre-rendered JSON body."""
+
+    body: bytes
+    generated_at: float
+    etag: str
+
+
 _lock = Lock()
-_state: dict[str, Any] = {"generated_at": 0.0, "snapshot": None}
+# Signalled when a claimed regeneration finishes; cold-start callers wait on it.
+_regenerated = Condition(_lock)
+_state: dict[str, Any] = {"generated_at": 0.0, "snapshot": None, "regenerating": False}
 
 
 def get_cached_snapshot(
@@ -130,32 +282,61 @@ def get_cached_snapshot(
     match_ratio: float = 0.7,
     force: bool = False,
     seed: int | None = None,
-) -> dict[str, Any]:
+) -> CachedSnapshot:
     # If counts are explicitly requested, always regenerate to match the request.
     if drivers_count is not None or users_count is not None:
         force = True
 
     now = time.time()
+    # The lock only guards `_state`; generation runs outside it so concurrent
+    # requests keep getting the stale snapshot while one thread regenerates.
+    # With nothing cached yet, they wait for that thread's result instead.
     with _lock:
-        snapshot = _state.get("snapshot")
-        generated_at = float(_state.get("generated_at") or 0.0)
-
-        if force or snapshot is None or (now - generated_at) >= regen_seconds:
-            snapshot = generate_snapshot(
-                max_count=max_count,
-                bounds=bounds,
-                drivers_count=drivers_count,
-                users_count=users_count,
-                match_ratio=match_ratio,
-                seed=seed,
-            )
-            _state["snapshot"] = snapshot
-            _state["generated_at"] = now
-
-        return snapshot
-
-
-def default_config() -> tuple[int, int, dict[str, float]]:
+        while True:
+            snapshot = _state["snapshot"]
+            generated_at = float(_state["generated_at"])
+            stale = snapshot is None or (now - generated_at) >= regen_seconds
+            if not force and not stale:
+                return snapshot
+            if force or not _state["regenerating"]:
+                break
+            if snapshot is not None:
+                return snapshot
+            _regenerated.wait()
+        claimed = not _state["regenerating"]
+        if claimed:
+            _state["regenerating"] = True
+
+    try:
+        data = generate_snapshot(
+            max_count=max_count,
+            bounds=bounds,
+            drivers_count=drivers_count,
+            users_count=users_count,
+            match_ratio=match_ratio,
+            seed=seed,
+        )
+        # Serialize once here so cache hits can ship the bytes as-is; the dict
+        # itself is dropped so the cache doesn't hold both forms.
+        body = orjson.dumps(data)
+        etag = hashlib.blake2b(repr(now).encode(), digest_size=8).hexdigest()
+        snapshot = CachedSnapshot(body=body, generated_at=now, etag=f'"{etag}"')
+        with _lock:
+            if now >= float(_state["generated_at"]):
+                _state["snapshot"] = snapshot
+                _state["generated_at"] = now
+    finally:
+        if claimed:
+            with _lock:
+                _state["regenerating"] = False
+                _regenerated.notify_all()
+
+    return snapshot
+
+
+@cache
+def default_config() -> tuple[int, int, dict[str, float], float]:
+    # Settings are fixed for the process lifetime; read them once, on first use.
     return (
         settings.SNAPSHOT_REGEN_SECONDS,
         settings.SNAPSHOT_MAX_COUNT,
@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import importlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from django.http import QueryDict
+from django.test import SimpleTestCase
+
+from . import generator, views
+
+
+BOUNDS = {"min_lat": 35.60, "max_lat": 35.82, "min_lng": 51.20, "max_lng": 51.60}
+
+
+def _reference_pairs(drivers, users, match_count, cos_lat):
+    # Plain-Python greedy over every pair, in distance order.
+    pairs = sorted(
+        (((d_lng - u_lng) * cos_lat) ** 2 + (d_lat - u_lat) ** 2, di, ui)
+        for di, (d_lat, d_lng) in enumerate(zip(drivers.lat.tolist(), drivers.lng.tolist()))
+        for ui, (u_lat, u_lng) in enumerate(zip(users.lat.tolist(), users.lng.tolist()))
+    )
+    used_drivers: set[int] = set()
+    used_users: set[int] = set()
+    out: list[tuple[int, int]] = []
+    for _, di, ui in pairs:
+        if len(out) >= match_count:
+            break
+        if di in used_drivers or ui in used_users:
+            continue
+        used_drivers.add(di)
+        used_users.add(ui)
+        out.append((di, ui))
+    return out
+
+
+def _dense_backends():
+    backends = {"numpy": None}
+    for name in ("_match_numba", "_match"):
+        try:
+            backends[name] = importlib.import_module(f"snapshot.{name}")
+        except ImportError:
+            pass
+    return backends
+
+
+class GreedyMatchTests(SimpleTestCase):
+    def test_backends_match_reference(self):
+        rng = np.random.default_rng(0)
+        cos_lat = generator._cos_lat(BOUNDS)
+        for case in range(20):
+            drivers = generator._generate_points("driver", int(rng.integers(1, 60)), BOUNDS, rng, case)
+            users = generator._generate_points("user", int(rng.integers(1, 60)), BOUNDS, rng, case)
+            match_count = int(rng.integers(0, min(len(drivers), len(users)) + 1))
+            expected = _reference_pairs(drivers, users, match_count, cos_lat)
+
+            for name, kernels in _dense_backends().items():
+                with self.subTest(case=case, backend=name), mock.patch.object(generator, "_dense_kernels", kernels):
+                    self.assertEqual(generator._greedy_pairs_dense(drivers, users, match_count, cos_lat), expected)
+            with self.subTest(case=case, backend="kdtree"):
+                self.assertEqual(generator._greedy_pairs_kdtree(drivers, users, match_count, cos_lat), expected)
+
+    def test_kdtree_single_user(self):
+        rng = np.random.default_rng(1)
+        cos_lat = generator._cos_lat(BOUNDS)
+        drivers = generator._generate_points("driver", 3, BOUNDS, rng, 1)
+        users = generator._generate_points("user", 1, BOUNDS, rng, 1)
+        self.assertEqual(
+            generator._greedy_pairs_kdtree(drivers, users, 3, cos_lat),
+            _reference_pairs(drivers, users, 3, cos_lat),
+        )
+
+
+class GenerateSnapshotTests(SimpleTestCase):
+    def _generate(self, match_ratio):
+        return generator.generate_snapshot(
+            max_count=50, bounds=BOUNDS, drivers_count=30, users_count=20, match_ratio=match_ratio, seed=7
+        )
+
+    def test_zero_ratio_matches_nobody(self):
+        self.assertEqual(self._generate(0.0)["matchs"], [])
+
+    def test_full_ratio_matches_the_smaller_side(self):
+        data = self._generate(1.0)
+        self.assertEqual(len(data["matchs"]), 20)
+        self.assertEqual({m["user"] for m in data["matchs"]}, {u["id"] for u in data["users"]})
+
+
+# Runs one Numba fill build in a fresh process and prints the threading layer it started.
+_NUMBA_LAYER_SCRIPT = """
+import sys
+import numba
+import numpy as np
+from snapshot import _match_numba
+
+points = [np.random.rand(50) for _ in range(4)]
+getattr(_match_numba, sys.argv[1])(*points, 0.8)
+try:
+    print(numba.threading_layer())
+except ValueError:
+    print("none")
+"""
+
+
+class NumbaCacheTests(SimpleTestCase):
+    @unittest.skipUnless(importlib.util.find_spec("numba"), "numba is not installed")
+    def test_only_parallel_build_starts_threading_layer(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = {**os.environ, "NUMBA_CACHE_DIR": cache_dir, "NUMBA_NUM_THREADS": "4"}
+
+            def layer(build):
+                result = subprocess.run(
+                    [sys.executable, "-c", _NUMBA_LAYER_SCRIPT, build],
+                    cwd=Path(__file__).resolve().parent.parent,
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                )
+                return result.stdout.strip()
+
+            # The second round loads both builds from the cache the first one wrote.
+            for _ in range(2):
+                self.assertEqual(layer("_fill_dist2_serial"), "none")
+                self.assertNotEqual(layer("_fill_dist2_parallel"), "none")
+
+
+class ParseParamsTests(SimpleTestCase):
+    def test_empty_and_missing_values_are_none(self):
+        params = views._parse_params(QueryDict("drivers=&match_ratio=&force="))
+        self.assertEqual(set(params), {name for name, _ in views._PARAM_SPEC})
+        self.assertTrue(all(value is None for value in params.values()))
+
+    def test_converts_values(self):
+        params = views._parse_params(QueryDict("drivers=12&seed=3&match_ratio=0.25"))
+        self.assertEqual(params["drivers"], 12)
+        self.assertEqual(params["seed"], 3)
+        self.assertIsInstance(params["match_ratio"], float)
+        self.assertEqual(params["match_ratio"], 0.25)
+
+    def test_bool_params(self):
+        for value in ("1", "true", "TRUE", "yes", "y", "on"):
+            with self.subTest(value=value):
+                params = views._parse_params(QueryDict(f"force={value}&meta={value}"))
+                self.assertIs(params["force"], True)
+                self.assertIs(params["meta"], True)
+        for value in ("0", "false", "no", "off", "2"):
+            with self.subTest(value=value):
+                params = views._parse_params(QueryDict(f"force={value}&meta={value}"))
+                self.assertIs(params["force"], False)
+                self.assertIs(params["meta"], False)
+
+
+class FreshCacheTestCase(SimpleTestCase):
+    """Runs each test against an empty snapshot cache, restored afterwards."""
+
+    def setUp(self):
+        patcher = mock.patch.dict(generator._state, {"generated_at": 0.0, "snapshot": None, "regenerating": False})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class SnapshotViewTests(FreshCacheTestCase):
+    # Small, seeded snapshots keep these fast and deterministic.
+    url = "/api/snapshot/?max_count=5&seed=1"
+
+    def test_forced_regeneration_invalidates_revalidation(self):
+        first = self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"]).status_code, 304)
+
+        self.client.get(self.url + "&force=1")
+        stale = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+        self.assertEqual(stale.status_code, 200)
+        self.assertNotEqual(stale["ETag"], first["ETag"])
+        self.assertFalse(stale.has_header("Last-Modified"))
+
+    def test_meta_is_spliced_into_valid_json(self):
+        response = self.client.get(self.url + "&meta=1")
+        data = json.loads(response.content)
+        self.assertEqual(set(data), {"drivers", "users", "matchs", "_meta"})
+        self.assertEqual(data["_meta"]["max_count"], 5)
+
+
+class CachedSnapshotTests(FreshCacheTestCase):
+    def test_cold_start_generates_once(self):
+        calls = []
+
+        def slow_generate(**kwargs):
+            calls.append(kwargs)
+            time.sleep(0.2)
+            return {"drivers": [], "users": [], "matchs": []}
+
+        results = []
+
+        def fetch():
+            results.append(generator.get_cached_snapshot(regen_seconds=20, max_count=10, bounds=BOUNDS))
+
+        with mock.patch.object(generator, "generate_snapshot", slow_generate):
+            threads = [threading.Thread(target=fetch) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        self.assertTrue(all(r is results[0] for r in results))
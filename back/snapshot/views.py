@@ -1,12 +1,42 @@
 from __future__ import annotations
 
+import time
+from typing import Any
+
+import orjson
 from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from .generator import default_config, get_cached_snapshot
 
 
+_TRUTHY = frozenset({"1", "true", "yes", "y", "on"})
+
+
+def _bool_param(value: str) -> bool:
+    return value.lower() in _TRUTHY
+
+
+# (query param, converter); empty or missing values parse to None.
+_PARAM_SPEC = (
+    ("regen_seconds", int),
+    ("max_count", int),
+    ("drivers", int),
+    ("users", int),
+    ("seed", int),
+    ("match_ratio", float),
+    ("force", _bool_param),
+    ("meta", _bool_param),
+)
+
+
+def _parse_params(query_params) -> dict[str, Any]:
+    return {name: conv(v) if (v := query_params.get(name)) else None for name, conv in _PARAM_SPEC}
+
+
 class HealthView(APIView):
     def get(self, request):
         return Response({"ok": True})
@@ -15,25 +45,16 @@ class HealthView(APIView):
 class SnapshotView(APIView):
     def get(self, request):
         regen_seconds_default, max_count_default, bounds_default, match_ratio_default = default_config()
+        params = _parse_params(request.query_params)
 
-        def int_param(name: str) -> int | None:
-            v = request.query_params.get(name)
-            if v is None or v == "":
-                return None
-            return int(v)
-
-        def bool_param(name: str) -> bool:
-            v = request.query_params.get(name, "")
-            return v.lower() in {"1", "true", "yes", "y", "on"}
-
-        regen_seconds = int_param("regen_seconds") or regen_seconds_default
-        max_count = int_param("max_count") or max_count_default
-        drivers_count = int_param("drivers")
-        users_count = int_param("users")
-        seed = int_param("seed")
-        force = bool_param("force")
-        match_ratio = request.query_params.get("match_ratio")
-        match_ratio_val = float(match_ratio) if match_ratio not in (None, "") else match_ratio_default
+        regen_seconds = params["regen_seconds"] or regen_seconds_default
+        max_count = params["max_count"] or max_count_default
+        drivers_count = params["drivers"]
+        users_count = params["users"]
+        seed = params["seed"]
+        force = bool(params["force"])
+        match_ratio = params["match_ratio"]
+        match_ratio_val = match_ratio if match_ratio is not None else match_ratio_default
 
         regen_seconds = max(1, min(60 * 60, regen_seconds))
         max_count = max(1, min(1000, max_count))
@@ -52,16 +73,29 @@ class SnapshotView(APIView):
         # Return exactly the JSON shape expected by the frontend:
         # { drivers: [...], users: [...], matchs: [...] }
         # (Optional debug: ?meta=1)
-        if bool_param("meta"):
-            snapshot = {
-                **snapshot,
-                "_meta": {
-                    "regen_seconds": regen_seconds,
-                    "max_count": max_count,
-                    "match_ratio": match_ratio_val,
-                    "bounds": bounds_default,
-                    "debug": settings.DEBUG,
-                },
+        if params["meta"]:
+            meta = {
+                "regen_seconds": regen_seconds,
+                "max_count": max_count,
+                "match_ratio": match_ratio_val,
+                "bounds": bounds_default,
+                "debug": settings.DEBUG,
             }
+            # Splice `_meta` into the cached object instead of re-encoding every point.
+            body = snapshot.body[:-1] + b',"_meta":' + orjson.dumps(meta) + b"}"
+            return HttpResponse(body, content_type="application/json")
+
+        # Cached bytes skip DRF rendering; the ETag lets clients revalidate and get a
+        # bodiless 304 until the next regeneration. No Last-Modified: its one-second
+        # precision can't tell apart two snapshots generated in the same second.
+        regenerated = force or drivers_count is not None or users_count is not None
+        if regenerated:
+            return HttpResponse(snapshot.body, content_type="application/json")
 
-        return Response(snapshot)
+        response = get_conditional_response(request, etag=snapshot.etag)
+        if response is None:
+            response = HttpResponse(snapshot.body, content_type="application/json")
+        max_age = max(0, int(snapshot.generated_at + regen_seconds - time.time()))
+        response["ETag"] = snapshot.etag
+        response["Cache-Control"] = f"max-age={max_age}"
+        return response